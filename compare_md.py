@@ -5,6 +5,7 @@ Streamlit app for comparing markdown outputs from PyMuPDF4LLM and LLM OCR.
 This app provides a side-by-side comparison interface with navigation controls
 and the ability to toggle between rendered and raw markdown views.
 """
+import os
 import streamlit as st
 from pathlib import Path
 
@@ -17,111 +18,168 @@ st.set_page_config(
 )
 
 
+def _mtime(path: Path) -> float | None:
+    """Return the modification time of a path, or None if it does not exist."""
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return None
+
+
+def _list_markdown_names(directory: str) -> set[str]:
+    """Return names of .md files in a directory, or an empty set if it does not exist."""
+    try:
+        with os.scandir(directory) as entries:
+            return {e.name for e in entries if e.name.endswith(".md") and e.is_file()}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
+@st.cache_data(ttl=60)
+def _load_markdown_files(folder: str, mtimes: tuple) -> list[str]:
+    """Cached body of load_markdown_files; mtimes invalidate the cache on change."""
+    md_dir = os.path.join(folder, "md")
+    llm_md_dir = os.path.join(folder, "llm_md")
+    
+    # Get list of files from both directories
+    md_files = _list_markdown_names(md_dir)
+    llm_md_files = _list_markdown_names(llm_md_dir)
+    
+    # Return intersection (common files) sorted
+    common_files = sorted(md_files & llm_md_files)
+    return common_files
+
+
 def load_markdown_files(folder_path: Path) -> list[str]:
     """
     Load and return sorted list of common page names from both md folders.
     
+    Results are cached and reused until either directory's mtime changes.
+    
     Args:
         folder_path: Base folder containing md/ and llm_md/ subdirectories
     
     Returns:
         Sorted list of page filenames (e.g., ['page_0001.md', 'page_0002.md'])
     """
-    md_dir = folder_path / "md"
-    llm_md_dir = folder_path / "llm_md"
-    
-    # Get list of files from both directories
-    md_files = set()
-    llm_md_files = set()
-    
-    if md_dir.exists():
-        md_files = {f.name for f in md_dir.glob("*.md")}
-    
-    if llm_md_dir.exists():
-        llm_md_files = {f.name for f in llm_md_dir.glob("*.md")}
-    
-    # Return intersection (common files) sorted
-    common_files = sorted(md_files & llm_md_files)
-    return common_files
+    mtimes = (_mtime(folder_path / "md"), _mtime(folder_path / "llm_md"))
+    return _load_markdown_files(str(folder_path), mtimes)
+
+
+@st.cache_data(ttl=300)
+def _read_markdown_file(file_path: str, mtime: float | None) -> str:
+    """Cached body of read_markdown_file; mtime invalidates the cache on change."""
+    path = Path(file_path)
+    try:
+        if mtime is None:
+            return f"*File not found: {path.name}*"
+        return path.read_text(encoding='utf-8')
+    except Exception as e:
+        return f"*Error reading file: {str(e)}*"
 
 
 def read_markdown_file(file_path: Path) -> str:
     """
     Read markdown file content, handling errors gracefully.
     
+    Content is cached and reused until the file's mtime changes.
+    
     Args:
         file_path: Path to the markdown file
     
     Returns:
         File content or error message
     """
-    try:
-        if not file_path.exists():
-            return f"*File not found: {file_path.name}*"
-        return file_path.read_text(encoding='utf-8')
-    except Exception as e:
-        return f"*Error reading file: {str(e)}*"
+    return _read_markdown_file(str(file_path), _mtime(file_path))
 
 
-def display_markdown_comparison(left_content: str, right_content: str, render_mode: str):
+def render_markdown_pane(placeholder, content: str, render_mode: str):
     """
-    Display two markdown contents side by side.
+    Fill a single-element placeholder with markdown content.
     
     Args:
-        left_content: Content for left column (PyMuPDF4LLM)
-        right_content: Content for right column (LLM OCR)
+        placeholder: Container returned by st.empty()
+        content: Markdown content to show
         render_mode: "Rendered" or "Raw Markdown"
     """
+    if render_mode == "Rendered":
+        placeholder.markdown(content)
+    else:
+        placeholder.code(content, language="markdown", line_numbers=True)
+
+
+def create_comparison_layout():
+    """
+    Create the side-by-side columns once, with an empty pane under each header.
+    
+    Returns:
+        Tuple of (left_pane, right_pane, left_stats, right_stats) st.empty()
+        placeholders, filled on every page change by navigation_and_display
+    """
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("📘 PyMuPDF4LLM Output (main.py)")
-        if render_mode == "Rendered":
-            st.markdown(left_content)
-        else:
-            st.code(left_content, language="markdown", line_numbers=True)
+        left_pane = st.empty()
     
     with col2:
         st.subheader("🤖 LLM OCR Output (llm_ocr.py)")
-        if render_mode == "Rendered":
-            st.markdown(right_content)
-        else:
-            st.code(right_content, language="markdown", line_numbers=True)
-
-
-def main():
-    """Main Streamlit app"""
-    
-    # Title and description
-    st.title("📄 OCR Markdown Comparison Tool")
-    st.markdown("""
-    Compare markdown outputs from **PyMuPDF4LLM** (traditional PDF extraction) 
-    and **LLM OCR** (vision-based extraction).
-    """)
+        right_pane = st.empty()
     
+    # Footer with stats
     st.divider()
+    stats_col1, stats_col2 = st.columns(2)
+    with stats_col1:
+        left_stats = st.empty()
+    with stats_col2:
+        right_stats = st.empty()
     
-    # Folder input
-    folder_input = st.text_input(
-        "Base Folder Path",
-        value="AR2024_C",
-        help="Enter the base folder containing md/ and llm_md/ subdirectories"
-    )
+    return left_pane, right_pane, left_stats, right_stats
+
+
+def display_markdown_comparison(placeholders: tuple, left_content: str, right_content: str,
+                                render_mode: str):
+    """
+    Display two markdown contents side by side.
     
-    folder_path = Path(folder_input)
+    Only the placeholders are refilled, so a page change replaces one element
+    per pane in place instead of rebuilding the column layout.
     
-    # Validate folder exists
-    if not folder_path.exists():
-        st.error(f"❌ Folder not found: {folder_path}")
-        st.stop()
+    Args:
+        placeholders: Placeholders returned by create_comparison_layout()
+        left_content: Content for left column (PyMuPDF4LLM)
+        right_content: Content for right column (LLM OCR)
+        render_mode: "Rendered" or "Raw Markdown"
+    """
+    left_pane, right_pane, left_stats, right_stats = placeholders
     
-    # Load available pages
-    pages = load_markdown_files(folder_path)
+    render_markdown_pane(left_pane, left_content, render_mode)
+    render_markdown_pane(right_pane, right_content, render_mode)
     
-    if not pages:
-        st.warning("⚠️ No matching markdown files found in both md/ and llm_md/ folders")
-        st.stop()
+    left_stats.caption(f"📊 Left: {len(left_content)} characters")
+    right_stats.caption(f"📊 Right: {len(right_content)} characters")
+
+
+def _step_page(step: int, page_count: int):
+    """Button callback: move the current page index by step, staying in range."""
+    st.session_state.page_index = min(max(st.session_state.page_index + step, 0), page_count - 1)
+
+
+@st.fragment
+def navigation_and_display(pages: list[str], folder_path: Path, placeholders: tuple):
+    """
+    Navigation controls, filling the side-by-side view for the current page.
     
+    Runs as a fragment, so clicks inside it rerun only this block rather
+    than the whole script (title, folder input, page discovery and the
+    comparison layout). The panes live outside the fragment; it only
+    replaces their contents.
+    
+    Args:
+        pages: Sorted list of page filenames available in both folders
+        folder_path: Base folder containing md/ and llm_md/ subdirectories
+        placeholders: Placeholders returned by create_comparison_layout()
+    """
     # Initialize session state for current page index
     if 'page_index' not in st.session_state:
         st.session_state.page_index = 0
@@ -138,10 +196,20 @@ def main():
     nav_col1, nav_col2, nav_col3 = st.columns([1, 3, 1])
     
     with nav_col1:
-        if st.button("⬅️ Previous", use_container_width=True):
-            if st.session_state.page_index > 0:
-                st.session_state.page_index -= 1
-                st.rerun()
+        st.button(
+            "⬅️ Previous",
+            use_container_width=True,
+            on_click=_step_page,
+            args=(-1, len(pages))
+        )
+    
+    with nav_col3:
+        st.button(
+            "Next ➡️",
+            use_container_width=True,
+            on_click=_step_page,
+            args=(1, len(pages))
+        )
     
     with nav_col2:
         # Dropdown selector
@@ -152,16 +220,7 @@ def main():
             label_visibility="collapsed"
         )
         # Update index if dropdown changed
-        new_index = pages.index(selected_page)
-        if new_index != st.session_state.page_index:
-            st.session_state.page_index = new_index
-            st.rerun()
-    
-    with nav_col3:
-        if st.button("Next ➡️", use_container_width=True):
-            if st.session_state.page_index < len(pages) - 1:
-                st.session_state.page_index += 1
-                st.rerun()
+        st.session_state.page_index = pages.index(selected_page)
     
     # Page counter
     st.caption(f"Page {st.session_state.page_index + 1} of {len(pages)}")
@@ -174,8 +233,6 @@ def main():
         label_visibility="collapsed"
     )
     
-    st.divider()
-    
     # Load current page content
     current_page = pages[st.session_state.page_index]
     
@@ -186,15 +243,50 @@ def main():
     right_content = read_markdown_file(right_file)
     
     # Display comparison
-    display_markdown_comparison(left_content, right_content, render_mode)
+    display_markdown_comparison(placeholders, left_content, right_content, render_mode)
+
+
+def main():
+    """Main Streamlit app"""
+    
+    # Title and description
+    st.title("📄 OCR Markdown Comparison Tool")
+    st.markdown("""
+    Compare markdown outputs from **PyMuPDF4LLM** (traditional PDF extraction) 
+    and **LLM OCR** (vision-based extraction).
+    """)
     
-    # Footer with stats
     st.divider()
-    stats_col1, stats_col2 = st.columns(2)
-    with stats_col1:
-        st.caption(f"📊 Left: {len(left_content)} characters")
-    with stats_col2:
-        st.caption(f"📊 Right: {len(right_content)} characters")
+    
+    # Folder input
+    folder_input = st.text_input(
+        "Base Folder Path",
+        value="AR2024_C",
+        help="Enter the base folder containing md/ and llm_md/ subdirectories"
+    )
+    
+    folder_path = Path(folder_input)
+    
+    # Validate folder exists
+    if not folder_path.exists():
+        st.error(f"❌ Folder not found: {folder_path}")
+        st.stop()
+    
+    # Load available pages
+    pages = load_markdown_files(folder_path)
+    
+    if not pages:
+        st.warning("⚠️ No matching markdown files found in both md/ and llm_md/ folders")
+        st.stop()
+    
+    # Navigation goes above the comparison but runs after it is laid out,
+    # so the fragment can fill the panes (and reruns on its own)
+    nav_area = st.container()
+    st.divider()
+    placeholders = create_comparison_layout()
+    
+    with nav_area:
+        navigation_and_display(pages, folder_path, placeholders)
 
 
 if __name__ == "__main__":
@@ -7,118 +7,203 @@ and save as markdown files. Uses Langfuse for monitoring and observability.
 """
 import asyncio
 import argparse
+import functools
+import hashlib
+import os
+import tempfile
+from io import BytesIO
 from pathlib import Path
+from PIL import Image
 from pydantic_ai import Agent, BinaryContent
 from langfuse import get_client
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
-
-# Initialize Langfuse client
-langfuse = get_client()
-
-# Verify connection and instrument agents
-if langfuse.auth_check():
-    print("Langfuse client is authenticated and ready!")
-    Agent.instrument_all()
-else:
-    print("Warning: Langfuse authentication failed. Proceeding without instrumentation.")
-
-# Create OCR agent
-ocr_agent = Agent(
-    'openrouter:google/gemini-2.5-flash-lite',
-    instrument=True,
-    system_prompt="""You are an expert OCR assistant. Extract all text from the provided image 
+# OCR model and prompts; all of them are part of the response cache key
+OCR_MODEL = 'openrouter:google/gemini-2.5-flash'
+OCR_SYSTEM_PROMPT = """You are an expert OCR assistant. Extract all text from the provided image 
 and format it as clean, well-structured markdown. Preserve the document structure, headings, 
-lists, tables, and formatting as much as possible. Output only the markdown content without 
-any additional commentary or explanation."""
-)
+lists, tables, and formatting as much as possible.
 
-# Create refinement agent
-refine_agent = Agent(
-    'openrouter:google/gemini-2.5-flash',
-    instrument=True,
-    system_prompt="""You are an expert text refinement specialist. Your task is to improve OCR-extracted text by:
+Before answering, verify your extraction against the image and refine it by:
 
 1. Correcting OCR misrecognitions and errors
 2. Fixing formatting issues, spacing, and line breaks
 3. Improving markdown structure and consistency
 4. Preserving the original document structure and meaning
-5. Using the provided image as reference to verify accuracy
 
-Output only the refined markdown content without any commentary."""
-)
+Output only the final refined markdown content without any additional commentary or explanation."""
+OCR_USER_PROMPT = "Extract all text from this image and format as markdown:"
+
+# Image media types by file extension
+_MEDIA_TYPE_MAP = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+}
+
+
+@functools.lru_cache(maxsize=1)
+def get_ocr_agent() -> Agent:
+    """
+    Set up Langfuse instrumentation and create the OCR agent on first use.
+    
+    Deferred until images are about to be processed so that --help and
+    argument errors do not pay for the Langfuse auth round-trip.
+    
+    Returns:
+        OCR agent (extraction and refinement in a single pass)
+    """
+    # Load environment variables
+    load_dotenv()
+    
+    # Verify Langfuse connection and instrument agents, if configured
+    if not os.getenv('LANGFUSE_PUBLIC_KEY'):
+        print("Langfuse is not configured (LANGFUSE_PUBLIC_KEY unset). Proceeding without instrumentation.")
+    elif get_client().auth_check():
+        print("Langfuse client is authenticated and ready!")
+        Agent.instrument_all()
+    else:
+        print("Warning: Langfuse authentication failed. Proceeding without instrumentation.")
+    
+    # Imported here: the OpenAI SDK is slow to import and only needed once work starts
+    import httpx
+    from pydantic_ai.models.openai import OpenAIChatModel
+    from pydantic_ai.providers.openrouter import OpenRouterProvider
+    
+    # Share one pooled HTTP/2 client across all requests in the batch: kept-alive
+    # connections are reused and HTTP/2 multiplexes concurrent requests
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+        timeout=httpx.Timeout(timeout=600, connect=5),
+    )
+    model = OpenAIChatModel(
+        OCR_MODEL.removeprefix('openrouter:'),
+        provider=OpenRouterProvider(http_client=http_client),
+    )
+    
+    return Agent(
+        model,
+        instrument=True,
+        system_prompt=OCR_SYSTEM_PROMPT
+    )
 
 
-async def process_image_to_markdown(image_path: Path) -> str:
+def load_image_content(image_path: Path, max_dim: int | None = None) -> BinaryContent:
     """
-    Process a single image file and extract text as markdown using LLM.
+    Read an image file once and wrap it for upload to the LLM.
     
     Args:
         image_path: Path to the image file
+        max_dim: Optional maximum width/height in pixels. If given, the image is
+            downscaled to fit and re-encoded as JPEG to cut upload size
     
     Returns:
-        Extracted text formatted as markdown
-    
-    Raises:
-        Exception if image processing fails
+        BinaryContent holding the image bytes and media type
     """
     # Read image bytes
     image_data = image_path.read_bytes()
     
     # Determine media type from extension
-    ext = image_path.suffix.lower()
-    media_type_map = {
-        '.png': 'image/png',
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-    }
-    media_type = media_type_map.get(ext, 'image/png')
+    media_type = _MEDIA_TYPE_MAP.get(image_path.suffix.lower(), 'image/png')
     
-    # Process with OCR agent
-    result = await ocr_agent.run(
-        [
-            "Extract all text from this image and format as markdown:",
-            BinaryContent(data=image_data, media_type=media_type),
-        ]
-    )
+    # Downscale and re-encode as JPEG
+    if max_dim is not None:
+        with Image.open(BytesIO(image_data)) as img:
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+            if img.mode not in ('L', 'RGB'):
+                img = img.convert('RGB')
+            buf = BytesIO()
+            img.save(buf, 'JPEG', quality=85, optimize=True)
+        image_data = buf.getvalue()
+        media_type = 'image/jpeg'
     
-    return result.output
+    return BinaryContent(data=image_data, media_type=media_type)
 
 
-async def refine_ocr_text(raw_text: str, image_path: Path) -> str:
+async def process_image_to_markdown(image: BinaryContent) -> str:
     """
-    Refine raw OCR text using both the text and original image as context.
+    Process a single image and extract text as markdown using LLM.
     
     Args:
-        raw_text: Raw OCR output to be refined
-        image_path: Path to original image for visual reference
+        image: Image content loaded with load_image_content()
     
     Returns:
-        Refined and corrected markdown text
-    """
-    image_data = image_path.read_bytes()
-    ext = image_path.suffix.lower()
-    media_type_map = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
-    media_type = media_type_map.get(ext, 'image/png')
+        Extracted text formatted as markdown
     
-    result = await refine_agent.run(
+    Raises:
+        Exception if image processing fails
+    """
+    # Process with OCR agent
+    result = await get_ocr_agent().run(
         [
-            f"Here is raw OCR text that may contain errors. Please refine and correct it using the image as reference:\n\n{raw_text}",
-            BinaryContent(data=image_data, media_type=media_type),
+            OCR_USER_PROMPT,
+            image,
         ]
     )
     
     return result.output
 
 
-async def process_folder(image_folder: str):
+def cache_key(image: BinaryContent) -> str:
+    """
+    Compute the response cache key for an image.
+    
+    The key covers the image bytes plus the model and prompts, so changing
+    either invalidates earlier results.
+    
+    Args:
+        image: Image content loaded with load_image_content()
+    
+    Returns:
+        Hex-encoded sha256 digest
+    """
+    h = hashlib.sha256()
+    for part in (OCR_MODEL, OCR_SYSTEM_PROMPT, OCR_USER_PROMPT, image.media_type):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    h.update(image.data)
+    return h.hexdigest()
+
+
+def read_cached_markdown(cache_dir: Path, key: str) -> str | None:
+    """Return the cached markdown for a key, or None on a cache miss."""
+    try:
+        return (cache_dir / f"{key}.md").read_text(encoding='utf-8')
+    except FileNotFoundError:
+        return None
+
+
+def write_cached_markdown(cache_dir: Path, key: str, markdown_text: str):
+    """Atomically store markdown for a key so interrupted runs never leave partial entries."""
+    fd, tmp_name = tempfile.mkstemp(dir=cache_dir, prefix=f"{key}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(markdown_text)
+        os.replace(tmp_name, cache_dir / f"{key}.md")
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+async def process_folder(
+    image_folder: str,
+    concurrency: int = 8,
+    use_cache: bool = True,
+    max_dim: int | None = None,
+):
     """
     Process all images in a folder and save markdown outputs.
     
+    Images are processed concurrently, one LLM call per image. Responses
+    are cached by image content in {parent_of_input}/llm_cache/, so reruns
+    only call the LLM for new or changed images.
+    
     Args:
         image_folder: Path to folder containing images
+        concurrency: Maximum number of images processed at once (default 8)
+        use_cache: Reuse and store cached LLM responses (default True)
+        max_dim: Optional maximum image width/height before upload (default: no resizing)
     """
     # Validate input folder
     input_path = Path(image_folder)
@@ -134,6 +219,11 @@ async def process_folder(image_folder: str):
     output_path = input_path.parent / "llm_md"
     output_path.mkdir(parents=True, exist_ok=True)
     
+    # Response cache directory: {parent_of_input}/llm_cache/
+    cache_path = input_path.parent / "llm_cache"
+    if use_cache:
+        cache_path.mkdir(parents=True, exist_ok=True)
+    
     # Find all image files (non-recursive)
     image_extensions = ['*.png', '*.jpg', '*.jpeg']
     image_files = []
@@ -147,40 +237,68 @@ async def process_folder(image_folder: str):
         print(f"No image files found in '{image_folder}'")
         return False
     
+    # Initialize the agent (and Langfuse) only once there is work to do
+    get_ocr_agent()
+    
     print(f"Found {len(image_files)} image(s) to process")
     print(f"Input folder: {input_path}")
     print(f"Output folder: {output_path}")
+    print(f"Cache folder: {cache_path if use_cache else 'disabled'}")
+    if max_dim is not None:
+        print(f"Max upload dimension: {max_dim}px (JPEG)")
+    print(f"Concurrency: {concurrency}")
     print("=" * 60)
     
-    # Process each image
-    success_count = 0
-    error_count = 0
-    
-    for idx, image_file in enumerate(image_files, start=1):
-        try:
-            print(f"[{idx}/{len(image_files)}] Processing {image_file.name}... ", end="", flush=True)
-            
-            # Extract text as markdown
-            raw_text = await process_image_to_markdown(image_file)
-            
-            # Refine the extracted text
-            markdown_text = await refine_ocr_text(raw_text, image_file)
-            
-            # Save to output file
-            output_file = output_path / f"{image_file.stem}.md"
-            output_file.write_text(markdown_text, encoding='utf-8')
-            
-            print(f"✓ Saved to {output_file.name}")
-            success_count += 1
-            
-        except Exception as e:
-            print(f"✗ Error: {str(e)}")
-            error_count += 1
+    # Process images concurrently, bounded by the semaphore
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {'done': 0, 'success': 0, 'cached': 0, 'error': 0}
+    
+    async def handle_one(image_file: Path):
+        async with semaphore:
+            try:
+                # Read the image once (off the event loop)
+                image = await asyncio.to_thread(load_image_content, image_file, max_dim)
+                
+                # Reuse a cached response for identical input if available
+                markdown_text = None
+                if use_cache:
+                    key = cache_key(image)
+                    markdown_text = await asyncio.to_thread(read_cached_markdown, cache_path, key)
+                cached = markdown_text is not None
+                
+                # Otherwise extract text as markdown and remember the result
+                if not cached:
+                    markdown_text = await process_image_to_markdown(image)
+                    if use_cache:
+                        await asyncio.to_thread(write_cached_markdown, cache_path, key, markdown_text)
+                
+                # Save to output file without blocking other in-flight requests
+                output_file = output_path / f"{image_file.stem}.md"
+                await asyncio.to_thread(output_file.write_text, markdown_text, encoding='utf-8')
+                
+                counts['done'] += 1
+                counts['success'] += 1
+                if cached:
+                    counts['cached'] += 1
+                note = " (cached)" if cached else ""
+                print(f"[{counts['done']}/{len(image_files)}] ✓ {image_file.name} -> {output_file.name}{note}")
+                
+            except Exception as e:
+                counts['done'] += 1
+                counts['error'] += 1
+                print(f"[{counts['done']}/{len(image_files)}] ✗ {image_file.name}: {str(e)}")
+    
+    await asyncio.gather(*[handle_one(f) for f in image_files], return_exceptions=True)
+    
+    success_count = counts['success']
+    error_count = counts['error']
     
     # Print summary
     print("=" * 60)
     print(f"Processing complete:")
     print(f"  ✓ Success: {success_count}")
+    if counts['cached'] > 0:
+        print(f"    (from cache: {counts['cached']})")
     if error_count > 0:
         print(f"  ✗ Errors: {error_count}")
     print(f"  Output location: {output_path}")
@@ -200,9 +318,19 @@ Examples:
   
   # Process color images
   uv run llm_ocr.py AR2024_C/png/
+  
+  # Limit the number of concurrent LLM requests
+  uv run llm_ocr.py AR2024_C/png_bw/ --concurrency 4
+  
+  # Downscale images to at most 1568px per side before upload
+  uv run llm_ocr.py AR2024_C/png_bw/ --max-dim 1568
+  
+  # Ignore cached responses and call the LLM for every image
+  uv run llm_ocr.py AR2024_C/png_bw/ --no-cache
 
 Output will be saved to a 'llm_md' folder in the parent directory of the input folder.
 For example: AR2024_C/png_bw/ → AR2024_C/llm_md/
+LLM responses are cached by image content in a sibling 'llm_cache' folder.
         '''
     )
     
@@ -211,10 +339,43 @@ For example: AR2024_C/png_bw/ → AR2024_C/llm_md/
         help='Path to folder containing images to process (png, jpg, jpeg)'
     )
     
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        metavar='N',
+        help='Maximum number of images processed concurrently (default: 8)'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        dest='use_cache',
+        action='store_false',
+        help='Do not read or write the LLM response cache'
+    )
+    
+    parser.add_argument(
+        '--max-dim',
+        type=int,
+        default=None,
+        metavar='PIXELS',
+        help='Downscale images to fit PIXELS x PIXELS and send as JPEG (default: upload as-is)'
+    )
+    
     args = parser.parse_args()
     
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.max_dim is not None and args.max_dim < 1:
+        parser.error("--max-dim must be at least 1")
+    
     # Process the folder
-    success = await process_folder(args.image_folder)
+    success = await process_folder(
+        args.image_folder,
+        concurrency=args.concurrency,
+        use_cache=args.use_cache,
+        max_dim=args.max_dim,
+    )
     
     return 0 if success else 1
 
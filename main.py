@@ -9,9 +9,45 @@ import pymupdf
 import pymupdf.layout
 import pymupdf4llm
 from pathlib import Path
+import os
 import sys
 import argparse
-from PIL import Image, ImageEnhance
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+
+def contrast_lut(mean, contrast_factor):
+    """
+    Build a 256-entry lookup table that scales contrast around a pivot.
+    
+    Matches PIL's ImageEnhance.Contrast, which blends each pixel with the
+    image's mean gray level: out = mean + (in - mean) * contrast_factor.
+    
+    Args:
+        mean: Mean gray level of the image (pivot of the contrast stretch)
+        contrast_factor: Contrast enhancement multiplier
+    
+    Returns:
+        uint8 numpy array of shape (256,) for use with cv2.LUT
+    """
+    mean = int(mean + 0.5)
+    levels = np.arange(256, dtype=np.float32)
+    return np.clip((levels - mean) * contrast_factor + mean, 0, 255).astype(np.uint8)
+
+def enhance_gray(gray_img, contrast_factor):
+    """
+    Apply contrast enhancement to a grayscale image array.
+    
+    Args:
+        gray_img: 2-D uint8 numpy array
+        contrast_factor: Contrast enhancement multiplier
+    
+    Returns:
+        Enhanced 2-D uint8 numpy array
+    """
+    lut = contrast_lut(cv2.mean(gray_img)[0], contrast_factor)
+    return cv2.LUT(gray_img, lut)
 
 def parse_page_range(range_str, total_pages):
     """
@@ -42,10 +78,8 @@ def parse_page_range(range_str, total_pages):
             start, end = part.split('-')
             start = int(start.strip())
             end = int(end.strip())
-            # Convert to 0-indexed and add to set
-            for i in range(start - 1, end):
-                if 0 <= i < total_pages:
-                    pages.add(i)
+            # Convert to 0-indexed, clamp to the document and add to set
+            pages.update(range(max(0, start - 1), min(total_pages, end)))
         else:
             # Handle single page like "3"
             page_num = int(part.strip()) - 1  # Convert to 0-indexed
@@ -54,7 +88,58 @@ def parse_page_range(range_str, total_pages):
     
     return sorted(list(pages))
 
-def export_pages_to_images(pdf_path, page_range, output_dir=None, dpi=150):
+# Per-process PDF handle for render workers, opened once by the initializer
+_worker_doc = None
+
+def _init_render_worker(pdf_path):
+    """Open the PDF once in each render worker process."""
+    global _worker_doc
+    _worker_doc = pymupdf.open(pdf_path)
+    cv2.setNumThreads(1)
+
+def _render_one(args):
+    """Render a single page to PNG (and optionally an enhanced BW copy) in a worker process."""
+    page_num, dpi, output_file, grayscale, bw_output_file, contrast_factor = args
+    page = _worker_doc[page_num]
+    
+    # Render page to pixmap (no alpha channel: pages are opaque)
+    zoom = dpi / 72  # 72 is the default DPI
+    colorspace = pymupdf.csGRAY if grayscale else pymupdf.csRGB
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+    pix.set_dpi(dpi, dpi)
+    
+    # Save as PNG
+    pix.save(output_file)
+    
+    # Derive the enhanced grayscale image from the same render
+    if bw_output_file is not None:
+        samples = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+        samples = samples[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+        if pix.n == 1:
+            gray_img = samples[:, :, 0]
+        else:
+            # Same luma weights as cv2.imread(..., IMREAD_GRAYSCALE) in process_images_to_bw
+            gray_img = cv2.cvtColor(samples, cv2.COLOR_RGB2GRAY)
+        if not cv2.imwrite(str(bw_output_file), enhance_gray(gray_img, contrast_factor)):
+            raise ValueError(f"Cannot write image '{bw_output_file}'")
+    return output_file
+
+def _default_workers(task_count):
+    """Number of worker processes to use for task_count independent tasks."""
+    return max(1, min(os.cpu_count() or 1, task_count))
+
+def _pool_context():
+    """
+    Start worker processes from a clean forkserver instead of forking this one.
+    
+    The parent may already run library threads (e.g. onnxruntime from the
+    pymupdf layout path), and forking a multi-threaded process can deadlock.
+    Workers reopen everything they need in their initializer.
+    """
+    return multiprocessing.get_context("forkserver")
+
+def export_pages_to_images(pdf_path, page_range, output_dir=None, dpi=150, workers=None, doc=None,
+                           grayscale=False, bw_output_dir=None, contrast_factor=1.25):
     """
     Export specific pages from a PDF as PNG images.
     
@@ -63,6 +148,14 @@ def export_pages_to_images(pdf_path, page_range, output_dir=None, dpi=150):
         page_range: Page range string like "1-5", "1,3,5-7", or "all"
         output_dir: Optional output directory. If None, uses PDF basename
         dpi: Resolution for exported images (default 150)
+        workers: Number of render processes. If None, uses the CPU count
+        doc: Optional already-open pymupdf.Document for pdf_path. If given, it is
+            only used to count pages and is left open for the caller to close;
+            each render worker process still opens pdf_path itself
+        grayscale: Render directly to grayscale instead of RGB (default False)
+        bw_output_dir: Optional directory for contrast-enhanced grayscale copies,
+            derived from the same render instead of re-decoding the saved PNGs
+        contrast_factor: Contrast multiplier for bw_output_dir images (default 1.25)
     
     Returns:
         True if successful, False otherwise
@@ -71,13 +164,16 @@ def export_pages_to_images(pdf_path, page_range, output_dir=None, dpi=150):
         export_pages_to_images("test.pdf", "1-5")
         export_pages_to_images("test.pdf", "all", output_dir="images")
         export_pages_to_images("test.pdf", "1,3,5", dpi=300)
+        export_pages_to_images("test.pdf", "1-5", output_dir="png", bw_output_dir="png_bw")
     """
     try:
         pdf_path = Path(pdf_path)
-        print(f"Opening PDF: {pdf_path}")
         
-        # Open the PDF document
-        doc = pymupdf.open(pdf_path)
+        # Open the PDF document unless the caller already did
+        own_doc = doc is None
+        if own_doc:
+            print(f"Opening PDF: {pdf_path}")
+            doc = pymupdf.open(pdf_path)
         total_pages = len(doc)
         print(f"  Total pages: {total_pages}")
         
@@ -86,12 +182,14 @@ def export_pages_to_images(pdf_path, page_range, output_dir=None, dpi=150):
             page_indices = parse_page_range(page_range, total_pages)
         except Exception as e:
             print(f"  ✗ Error parsing page range '{page_range}': {str(e)}")
-            doc.close()
+            if own_doc:
+                doc.close()
             return False
         
         if not page_indices:
             print(f"  ✗ No valid pages in range '{page_range}'")
-            doc.close()
+            if own_doc:
+                doc.close()
             return False
         
         print(f"  Pages to export: {len(page_indices)}")
@@ -104,26 +202,36 @@ def export_pages_to_images(pdf_path, page_range, output_dir=None, dpi=150):
         output_path.mkdir(parents=True, exist_ok=True)
         print(f"  Output directory: {output_path}")
         
-        # Calculate zoom factor for desired DPI
-        zoom = dpi / 72  # 72 is the default DPI
-        mat = pymupdf.Matrix(zoom, zoom)
-        
-        # Export each page
-        for idx, page_num in enumerate(page_indices, start=1):
-            page = doc[page_num]
-            
-            # Render page to pixmap
-            pix = page.get_pixmap(matrix=mat)
-            
-            # Create output filename with 4-digit padding
-            output_file = output_path / f"page_{page_num + 1:04d}.png"
-            
-            # Save as PNG
-            pix.save(output_file)
-            
-            print(f"  ✓ [{idx}/{len(page_indices)}] Saved page {page_num + 1} -> {output_file}")
-        
-        doc.close()
+        bw_output_path = None
+        if bw_output_dir is not None:
+            bw_output_path = Path(bw_output_dir)
+            bw_output_path.mkdir(parents=True, exist_ok=True)
+            print(f"  Grayscale output directory: {bw_output_path}")
+        
+        # Render pages in parallel, each worker holding its own open document
+        # Output filenames use 4-digit padding
+        tasks = []
+        for page_num in page_indices:
+            filename = f"page_{page_num + 1:04d}.png"
+            bw_output_file = bw_output_path / filename if bw_output_path else None
+            tasks.append(
+                (page_num, dpi, output_path / filename, grayscale, bw_output_file, contrast_factor)
+            )
+        if workers is None:
+            workers = _default_workers(len(tasks))
+        
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=_pool_context(),
+            initializer=_init_render_worker,
+            initargs=(str(pdf_path),),
+        ) as executor:
+            results = executor.map(_render_one, tasks)
+            for idx, (page_num, output_file) in enumerate(zip(page_indices, results), start=1):
+                print(f"  ✓ [{idx}/{len(page_indices)}] Saved page {page_num + 1} -> {output_file}")
+        
+        if own_doc:
+            doc.close()
         print(f"\n✓ Successfully exported {len(page_indices)} page(s) to '{output_path}'")
         return True
         
@@ -131,7 +239,7 @@ def export_pages_to_images(pdf_path, page_range, output_dir=None, dpi=150):
         print(f"  ✗ Error: {str(e)}")
         return False
 
-def export_pages_to_markdown(pdf_path, page_range, output_dir=None):
+def export_pages_to_markdown(pdf_path, page_range, output_dir=None, doc=None):
     """
     Export specific pages from a PDF as individual markdown files.
     
@@ -139,6 +247,8 @@ def export_pages_to_markdown(pdf_path, page_range, output_dir=None):
         pdf_path: Path to the PDF file
         page_range: Page range string like "1-5", "1,3,5-7", or "all"
         output_dir: Optional output directory. If None, uses PDF basename
+        doc: Optional already-open pymupdf.Document for pdf_path. If given,
+            it is used as-is and left open for the caller to close
     
     Returns:
         True if successful, False otherwise
@@ -149,10 +259,12 @@ def export_pages_to_markdown(pdf_path, page_range, output_dir=None):
     """
     try:
         pdf_path = Path(pdf_path)
-        print(f"Opening PDF: {pdf_path}")
         
-        # Open the PDF document
-        doc = pymupdf.open(pdf_path)
+        # Open the PDF document unless the caller already did
+        own_doc = doc is None
+        if own_doc:
+            print(f"Opening PDF: {pdf_path}")
+            doc = pymupdf.open(pdf_path)
         total_pages = len(doc)
         print(f"  Total pages: {total_pages}")
         
@@ -161,12 +273,14 @@ def export_pages_to_markdown(pdf_path, page_range, output_dir=None):
             page_indices = parse_page_range(page_range, total_pages)
         except Exception as e:
             print(f"  ✗ Error parsing page range '{page_range}': {str(e)}")
-            doc.close()
+            if own_doc:
+                doc.close()
             return False
         
         if not page_indices:
             print(f"  ✗ No valid pages in range '{page_range}'")
-            doc.close()
+            if own_doc:
+                doc.close()
             return False
         
         print(f"  Pages to export: {len(page_indices)}")
@@ -179,12 +293,10 @@ def export_pages_to_markdown(pdf_path, page_range, output_dir=None):
         output_path.mkdir(parents=True, exist_ok=True)
         print(f"  Output directory: {output_path}")
         
-        doc.close()
-        
-        # Export each page as markdown
+        # Export each page as markdown from the already-open document
         for idx, page_num in enumerate(page_indices, start=1):
             # Extract markdown for this specific page only
-            md_text = pymupdf4llm.to_markdown(str(pdf_path), pages=[page_num])
+            md_text = pymupdf4llm.to_markdown(doc, pages=[page_num])
             
             # Create output filename with 4-digit padding
             output_file = output_path / f"page_{page_num + 1:04d}.md"
@@ -195,6 +307,9 @@ def export_pages_to_markdown(pdf_path, page_range, output_dir=None):
             
             print(f"  ✓ [{idx}/{len(page_indices)}] Saved page {page_num + 1} -> {output_file}")
         
+        if own_doc:
+            doc.close()
+        
         print(f"\n✓ Successfully exported {len(page_indices)} page(s) to '{output_path}'")
         return True
         
@@ -202,13 +317,35 @@ def export_pages_to_markdown(pdf_path, page_range, output_dir=None):
         print(f"  ✗ Error: {str(e)}")
         return False
 
-def process_images_to_bw(input_dir, contrast_factor=1.25):
+def _init_bw_worker():
+    """Keep OpenCV single-threaded inside each worker process."""
+    cv2.setNumThreads(1)
+
+def _bw_one(args):
+    """Convert a single PNG to enhanced grayscale in a worker process."""
+    png_file, contrast_factor, output_file = args
+    
+    # Decode directly to grayscale
+    gray_img = cv2.imread(str(png_file), cv2.IMREAD_GRAYSCALE)
+    if gray_img is None:
+        raise ValueError(f"Cannot read image '{png_file}'")
+    
+    # Enhance contrast with a single lookup-table pass
+    enhanced_img = enhance_gray(gray_img, contrast_factor)
+    
+    # Save to output directory
+    if not cv2.imwrite(str(output_file), enhanced_img):
+        raise ValueError(f"Cannot write image '{output_file}'")
+    return output_file
+
+def process_images_to_bw(input_dir, contrast_factor=1.25, workers=None):
     """
     Convert color PNG images to grayscale with enhanced contrast for VLM optimization.
     
     Args:
         input_dir: Directory containing color PNG images (e.g., "AR2024_C/png/")
         contrast_factor: Contrast enhancement multiplier (default 1.25 for moderate increase)
+        workers: Number of worker processes. If None, uses the CPU count
     
     Returns:
         Tuple of (success: bool, processed_count: int)
@@ -227,6 +364,9 @@ def process_images_to_bw(input_dir, contrast_factor=1.25):
         # Create output directory (replace last part with _bw suffix)
         output_dir = str(input_path).replace('/png', '/png_bw')
         output_path = Path(output_dir)
+        if output_path == input_path:
+            # No '/png' component to rename, never overwrite the inputs
+            output_path = input_path.with_name(f"{input_path.name}_bw")
         output_path.mkdir(parents=True, exist_ok=True)
         
         # Find all PNG files
@@ -238,24 +378,18 @@ def process_images_to_bw(input_dir, contrast_factor=1.25):
         
         print(f"  Processing {len(png_files)} image(s) to grayscale...")
         
+        tasks = [(png_file, contrast_factor, output_path / png_file.name) for png_file in png_files]
+        if workers is None:
+            workers = _default_workers(len(tasks))
+        
         processed_count = 0
-        for idx, png_file in enumerate(png_files, start=1):
-            # Open image
-            img = Image.open(png_file)
-            
-            # Convert to grayscale
-            gray_img = img.convert('L')
-            
-            # Enhance contrast
-            enhancer = ImageEnhance.Contrast(gray_img)
-            enhanced_img = enhancer.enhance(contrast_factor)
-            
-            # Save to output directory
-            output_file = output_path / png_file.name
-            enhanced_img.save(output_file)
-            
-            print(f"  ✓ [{idx}/{len(png_files)}] Processed {png_file.name} -> {output_file}")
-            processed_count += 1
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=_pool_context(), initializer=_init_bw_worker
+        ) as executor:
+            results = executor.map(_bw_one, tasks)
+            for idx, (png_file, output_file) in enumerate(zip(png_files, results), start=1):
+                print(f"  ✓ [{idx}/{len(png_files)}] Processed {png_file.name} -> {output_file}")
+                processed_count += 1
         
         print(f"\n✓ Successfully processed {processed_count} image(s) to '{output_path}'")
         return True, processed_count
@@ -264,7 +398,7 @@ def process_images_to_bw(input_dir, contrast_factor=1.25):
         print(f"  ✗ Error processing images: {str(e)}")
         return False, 0
 
-def export_pages_combined(pdf_path, page_range, dpi=150):
+def export_pages_combined(pdf_path, page_range, dpi=150, grayscale=False):
     """
     Export pages from a PDF as both markdown and PNG images.
     
@@ -284,6 +418,7 @@ def export_pages_combined(pdf_path, page_range, dpi=150):
         pdf_path: Path to the PDF file
         page_range: Page range string like "1-5", "1,3,5-7", or "all"
         dpi: Resolution for exported images (default 150)
+        grayscale: Render png/ in grayscale instead of color (default False)
     
     Returns:
         True if successful, False otherwise
@@ -291,6 +426,7 @@ def export_pages_combined(pdf_path, page_range, dpi=150):
     Examples:
         export_pages_combined("test.pdf", "1-5")
         export_pages_combined("test.pdf", "all", dpi=300)
+        export_pages_combined("test.pdf", "1-5", grayscale=True)
     """
     try:
         pdf_path = Path(pdf_path)
@@ -300,40 +436,44 @@ def export_pages_combined(pdf_path, page_range, dpi=150):
         print(f"Base output directory: {base_dir}/")
         print(f"Page range: {page_range}\n")
         
-        # Export markdown files
-        print("=" * 60)
-        print("MARKDOWN EXPORT")
-        print("=" * 60)
-        md_dir = f"{base_dir}/md"
-        md_success = export_pages_to_markdown(pdf_path, page_range, output_dir=md_dir)
-        
-        print()
-        
-        # Export PNG files
-        print("=" * 60)
-        print("PNG EXPORT")
-        print("=" * 60)
-        png_dir = f"{base_dir}/png"
-        png_success = export_pages_to_images(pdf_path, page_range, output_dir=png_dir, dpi=dpi)
-        
-        print()
-        
-        # Process images to grayscale with enhanced contrast
-        print("=" * 60)
-        print("GRAYSCALE PROCESSING (VLM Optimization)")
-        print("=" * 60)
-        bw_success, bw_count = process_images_to_bw(png_dir)
+        # Open the PDF once in this process and share it between the exporters
+        # (image render workers still open their own handle)
+        print(f"Opening PDF: {pdf_path}")
+        doc = pymupdf.open(pdf_path)
+        try:
+            # Export markdown files
+            print("=" * 60)
+            print("MARKDOWN EXPORT")
+            print("=" * 60)
+            md_dir = f"{base_dir}/md"
+            md_success = export_pages_to_markdown(pdf_path, page_range, output_dir=md_dir, doc=doc)
+            
+            print()
+            
+            # Export PNG files, deriving the grayscale copies (enhanced contrast,
+            # VLM optimization) from the same render
+            print("=" * 60)
+            print("PNG EXPORT (color + grayscale)")
+            print("=" * 60)
+            png_dir = f"{base_dir}/png"
+            bw_dir = f"{base_dir}/png_bw"
+            png_success = export_pages_to_images(
+                pdf_path, page_range, output_dir=png_dir, dpi=dpi, doc=doc,
+                grayscale=grayscale, bw_output_dir=bw_dir
+            )
+        finally:
+            doc.close()
         
         print()
         print("=" * 60)
         print("SUMMARY")
         print("=" * 60)
         
-        if md_success and png_success and bw_success:
+        if md_success and png_success:
             print(f"✓ Successfully exported to:")
             print(f"  - Markdown files: {md_dir}/")
-            print(f"  - PNG files (color): {png_dir}/")
-            print(f"  - PNG files (grayscale): {base_dir}/png_bw/")
+            print(f"  - PNG files ({'grayscale' if grayscale else 'color'}): {png_dir}/")
+            print(f"  - PNG files (grayscale): {bw_dir}/")
             return True
         else:
             print("✗ Some exports failed:")
@@ -341,8 +481,6 @@ def export_pages_combined(pdf_path, page_range, dpi=150):
                 print(f"  - Markdown export failed")
             if not png_success:
                 print(f"  - PNG export failed")
-            if not bw_success:
-                print(f"  - Grayscale processing failed")
             return False
         
     except Exception as e:
@@ -429,6 +567,12 @@ Examples:
   # Export specific pages
   python main.py --export-pages document.pdf --range 1,3,5-7
   
+  # Render the png/ pages in grayscale instead of color
+  python main.py --export-pages document.pdf --range 1-5 --grayscale
+  
+  # Only convert already exported PNGs to enhanced grayscale (writes document/png_bw/)
+  python main.py --bw-only document/png
+  
   # Legacy: batch extract markdown from directory
   python main.py pdfs/
         '''
@@ -456,6 +600,19 @@ Examples:
         help='Resolution for PNG export (default: 150)'
     )
     
+    parser.add_argument(
+        '--grayscale',
+        action='store_true',
+        help='Render PNG pages in grayscale instead of color (with --export-pages)'
+    )
+    
+    parser.add_argument(
+        '--bw-only',
+        dest='bw_dir',
+        metavar='PNG_DIR',
+        help='Only convert existing PNG images to enhanced grayscale, without touching the PDF'
+    )
+    
     parser.add_argument(
         'path',
         nargs='?',
@@ -479,7 +636,14 @@ Examples:
             sys.exit(1)
         
         # Export pages as both markdown and PNG
-        success = export_pages_combined(pdf_path, args.page_range, dpi=args.dpi)
+        success = export_pages_combined(
+            pdf_path, args.page_range, dpi=args.dpi, grayscale=args.grayscale
+        )
+        sys.exit(0 if success else 1)
+    
+    # Grayscale conversion of an existing PNG directory
+    elif args.bw_dir:
+        success, _ = process_images_to_bw(args.bw_dir)
         sys.exit(0 if success else 1)
     
     # Legacy mode: process file or directory